@@ -1,18 +1,40 @@
 import argparse
+import hashlib
 import os
 import re
+import tempfile
+import time
 import warnings
-from decimal import Decimal, InvalidOperation
+from contextlib import suppress
 from pathlib import Path
 import tkinter as tk
 from tkinter import filedialog, messagebox
 
+import numpy as np
 import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
+from python_calamine import CalamineWorkbook
 
 
 ID_BRACKET_RE = re.compile(r"\[(\d+)\]")
 
+# Cell texts that read_excel treats as missing (pandas' default na_values).
+NA_STRINGS = frozenset(
+    {
+        "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+        "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+    }
+)
+
+# Bump CACHE_VERSION whenever prepare_file1/prepare_file2 change their output,
+# so cached frames from older parsing logic are not reused.
+CACHE_VERSION = 3
+CACHE_DIR = Path(tempfile.gettempdir()) / "monthly_report_cache"
+CACHE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+
 # Some source workbooks contain an invalid print-area defined name.
 # This warning does not affect data reading, so we hide it in console output.
 warnings.filterwarnings(
@@ -21,69 +43,120 @@ warnings.filterwarnings(
     category=UserWarning,
 )
 
+# Copy-on-Write is always on from pandas 3.0. Enable it on older versions too,
+# so filtered frames can be modified without defensive .copy() calls.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
-def parse_amount(value) -> Decimal | None:
-    if value is None or (isinstance(value, float) and pd.isna(value)):
-        return None
 
-    text = str(value).strip().replace(" ", "")
-    if not text:
-        return None
+def parse_amounts(values: pd.Series) -> pd.Series:
+    # Support both "123,45" and "123.45"; unparsable cells become NaN.
+    text = (
+        values.astype("string")
+        .str.strip()
+        .str.replace(" ", "", regex=False)
+        .str.replace(",", ".", regex=False)
+    )
+    return pd.to_numeric(text, errors="coerce").astype("float64")
+
+
+def read_sheet_columns(path: Path, skiprows: int, usecols: list[int]) -> pd.DataFrame:
+    # Pick the needed columns (0-based) straight from the calamine rows instead
+    # of running pandas' Excel parser over every column up to the last one.
+    sheet = CalamineWorkbook.from_path(str(path)).get_sheet_by_index(0)
+    rows = sheet.to_python(skip_empty_area=False)[skiprows:]
+
+    def cell_value(row: list, col_idx: int):
+        value = row[col_idx] if col_idx < len(row) else None
+        if isinstance(value, str) and value in NA_STRINGS:
+            return None
+        # Match read_excel: whole-number floats (e.g. numeric IDs) become ints.
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    return pd.DataFrame(
+        {col_idx: [cell_value(row, col_idx) for row in rows] for col_idx in usecols},
+        dtype=object,
+    )
+
+
+def cache_path(path: Path, layout: str) -> Path:
+    # Parsed exports are cached per (parser version, layout, file, mtime, size),
+    # so repeated runs on unchanged files (e.g. from the GUI) skip XLSX parsing.
+    stat = path.stat()
+    key = f"v{CACHE_VERSION}-{layout}-{path.resolve()}-{stat.st_mtime_ns}-{stat.st_size}"
+    return CACHE_DIR / f"{hashlib.md5(key.encode()).hexdigest()}.parquet"
+
 
-    # Support both "123,45" and "123.45".
-    text = text.replace(",", ".")
+def load_cache(cache: Path) -> pd.DataFrame | None:
+    if not cache.exists():
+        return None
     try:
-        return Decimal(text)
-    except InvalidOperation:
+        df = pd.read_parquet(cache)
+    except Exception:
+        # Corrupt or unreadable entry: drop it and parse the file again.
+        with suppress(OSError):
+            cache.unlink()
         return None
+    # Mark the entry as recently used so prune_cache keeps it.
+    with suppress(OSError):
+        os.utime(cache)
+    return df
 
 
-def parse_id_from_file1(name_with_id) -> str | None:
-    if name_with_id is None or (isinstance(name_with_id, float) and pd.isna(name_with_id)):
-        return None
-    match = ID_BRACKET_RE.search(str(name_with_id))
-    return match.group(1) if match else None
+def prune_cache() -> None:
+    # Cached frames hold payment data, so do not keep entries around forever.
+    cutoff = time.time() - CACHE_MAX_AGE_SECONDS
+    for entry in CACHE_DIR.iterdir():
+        with suppress(OSError):
+            if entry.stat().st_mtime < cutoff:
+                entry.unlink()
 
 
-def parse_id_from_file2(raw_id) -> str | None:
-    if raw_id is None or (isinstance(raw_id, float) and pd.isna(raw_id)):
-        return None
-    text = str(raw_id).strip()
-    if not text:
-        return None
-    return text.split(",")[0].strip()
+def save_cache(df: pd.DataFrame, cache: Path) -> None:
+    # The cache is best effort: a failed write must never abort the comparison.
+    # Write next to the target and rename, so a crash never leaves a partial cache.
+    tmp_path = cache.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        prune_cache()
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, cache)
+    except Exception:
+        with suppress(OSError):
+            tmp_path.unlink()
 
 
 def prepare_file1(path: Path) -> pd.DataFrame:
     # File 1 layout:
     # - company with ID in column D starting row 9 (in some exports can be C)
     # - amount in column AF
-    df = pd.read_excel(
-        path,
-        sheet_name=0,
-        header=None,
-        skiprows=8,
-        usecols="C,D,AF",
-        engine="openpyxl",
-    )
+    cache = cache_path(path, "file1")
+    cached = load_cache(cache)
+    if cached is not None:
+        return cached
+
+    df = read_sheet_columns(path, skiprows=8, usecols=[2, 3, 31])
     df.columns = ["name_c", "name_d", "amount"]
 
     # Prefer D by specification, fallback to C when D is empty.
     df["company_raw"] = df["name_d"].where(df["name_d"].notna(), df["name_c"])
-    df["company_id"] = df["company_raw"].apply(parse_id_from_file1)
-    df["amount_1"] = df["amount"].apply(parse_amount)
+    df["company_id"] = df["company_raw"].astype("string").str.extract(ID_BRACKET_RE, expand=False)
+    df["amount_1"] = parse_amounts(df["amount"])
 
-    out = df.loc[df["company_id"].notna(), ["company_id", "company_raw", "amount_1"]].copy()
+    out = df.loc[df["company_id"].notna(), ["company_id", "company_raw", "amount_1"]]
     out["company_id"] = out["company_id"].astype(str).str.strip()
     out["company_name_1"] = out["company_raw"].astype(str).str.strip()
 
     agg = (
-        out.groupby("company_id", as_index=False)
+        out.groupby("company_id")
         .agg(
-            amount_1=("amount_1", lambda x: sum((v for v in x if v is not None), Decimal("0"))),
+            amount_1=("amount_1", "sum"),
             company_name_1=("company_name_1", "first"),
         )
     )
+    save_cache(agg, cache)
     return agg
 
 
@@ -92,31 +165,33 @@ def prepare_file2(path: Path) -> pd.DataFrame:
     # - ID in column A starting row 5, format "*,000" (use part before comma)
     # - company name in column C by specification (in some exports can be B)
     # - amount in column F
-    df = pd.read_excel(
-        path,
-        sheet_name=0,
-        header=None,
-        skiprows=4,
-        usecols="A,B,C,F",
-        engine="openpyxl",
-    )
+    cache = cache_path(path, "file2")
+    cached = load_cache(cache)
+    if cached is not None:
+        return cached
+
+    df = read_sheet_columns(path, skiprows=4, usecols=[0, 1, 2, 5])
     df.columns = ["raw_id", "name_b", "name_c", "amount"]
 
-    df["company_id"] = df["raw_id"].apply(parse_id_from_file2)
+    raw_id = df["raw_id"].astype("string").str.strip()
+    df["company_id"] = raw_id.str.split(",", n=1).str[0].str.strip().where(raw_id.ne(""))
     df["company_raw"] = df["name_c"].where(df["name_c"].notna(), df["name_b"])
-    df["amount_2"] = df["amount"].apply(parse_amount)
+    df["amount_2"] = parse_amounts(df["amount"])
 
-    out = df.loc[df["company_id"].notna(), ["company_id", "company_raw", "amount_2"]].copy()
+    out = df.loc[df["company_id"].notna(), ["company_id", "company_raw", "amount_2"]]
     out["company_id"] = out["company_id"].astype(str).str.strip()
-    out["company_name_2"] = out["company_raw"].astype(str).str.strip()
+    # A row may carry an ID without a company name; keep that name empty
+    # instead of letting astype(str) turn it into "None"/"nan" text.
+    out["company_name_2"] = out["company_raw"].astype(str).str.strip().where(out["company_raw"].notna())
 
     agg = (
-        out.groupby("company_id", as_index=False)
+        out.groupby("company_id")
         .agg(
-            amount_2=("amount_2", lambda x: sum((v for v in x if v is not None), Decimal("0"))),
+            amount_2=("amount_2", "sum"),
             company_name_2=("company_name_2", "first"),
         )
     )
+    save_cache(agg, cache)
     return agg
 
 
@@ -126,23 +201,37 @@ def compare(file1: Path, file2: Path) -> tuple[pd.DataFrame, pd.DataFrame]:
     file1_name = file1.name
     file2_name = file2.name
 
-    merged = left.merge(right, on="company_id", how="outer")
-    merged["amount_1"] = merged["amount_1"].fillna(Decimal("0"))
-    merged["amount_2"] = merged["amount_2"].fillna(Decimal("0"))
+    # Both frames are indexed by company_id; look their columns up over the
+    # union of IDs instead of running a full outer join. groupby already
+    # sorted each index and union keeps that order, which is also the final
+    # report order: ascending by column A (company_id).
+    all_ids = left.index.union(right.index)
+    merged = pd.DataFrame({"company_id": all_ids})
+    merged["company_name_1"] = all_ids.map(left["company_name_1"])
+    merged["company_name_2"] = all_ids.map(right["company_name_2"])
+    merged["amount_1"] = all_ids.map(left["amount_1"])
+    merged["amount_2"] = all_ids.map(right["amount_2"])
+    merged = merged.fillna({"amount_1": 0, "amount_2": 0})
+    # Amounts are float64 from here on and go to the report as is.
+    merged[["amount_1", "amount_2"]] = merged[["amount_1", "amount_2"]].astype("float64")
     merged["delta"] = merged["amount_1"] - merged["amount_2"]
 
-    def get_status(row) -> str:
-        has_1 = pd.notna(row.get("company_name_1"))
-        has_2 = pd.notna(row.get("company_name_2"))
-        if has_1 and has_2:
-            return "MATCH" if row["delta"] == 0 else "MISMATCH"
-        if has_1:
-            return f"only_file_{file1_name}"
-        return f"only_file_{file2_name}"
-
-    merged["status"] = merged.apply(get_status, axis=1)
-    # Final report order: ascending by column A (company_id).
-    merged = merged.sort_values(by=["company_id"]).reset_index(drop=True)
+    # Presence is decided by the ID, since a name can be missing in the export.
+    has_1 = all_ids.isin(left.index)
+    has_2 = all_ids.isin(right.index)
+    # Float sums of the same payments can differ in the last bits depending on
+    # row order, so compare with a tolerance that scales with the amounts. It
+    # stays far below any real difference (3.333 vs 3.334 is a MISMATCH).
+    is_match = np.isclose(
+        merged["amount_1"].to_numpy(), merged["amount_2"].to_numpy(), rtol=1e-12, atol=1e-9
+    )
+    # Report matched amounts with a clean zero delta instead of summation noise.
+    merged["delta"] = np.where(is_match, 0.0, merged["delta"].to_numpy())
+    merged["status"] = np.select(
+        [has_1 & has_2 & is_match, has_1 & has_2, has_1],
+        ["MATCH", "MISMATCH", f"only_file_{file1_name}"],
+        default=f"only_file_{file2_name}",
+    )
 
     detail = merged[
         [
@@ -154,15 +243,15 @@ def compare(file1: Path, file2: Path) -> tuple[pd.DataFrame, pd.DataFrame]:
             "delta",
             "status",
         ]
-    ].copy()
+    ]
 
     summary = (
         detail.groupby("status", as_index=False)
         .agg(
-            rows=("company_id", "count"),
-            total_amount_1=("amount_1", lambda x: sum(x, Decimal("0"))),
-            total_amount_2=("amount_2", lambda x: sum(x, Decimal("0"))),
-            total_delta=("delta", lambda x: sum(x, Decimal("0"))),
+            rows=("company_id", "size"),
+            total_amount_1=("amount_1", "sum"),
+            total_amount_2=("amount_2", "sum"),
+            total_delta=("delta", "sum"),
         )
         .sort_values(by="status")
     )
@@ -179,65 +268,57 @@ def compare(file1: Path, file2: Path) -> tuple[pd.DataFrame, pd.DataFrame]:
     return detail, summary
 
 
-def to_numeric_columns(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
-    out = df.copy()
-    for col in cols:
-        out[col] = out[col].astype(str).astype(float)
-    return out
-
-
 def write_report(detail: pd.DataFrame, summary: pd.DataFrame, out_path: Path) -> None:
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    detail_amount_cols = [col for col in detail.columns if col.startswith("amount__")]
-    detail_out = to_numeric_columns(detail, detail_amount_cols + ["delta"])
-    summary_out = to_numeric_columns(
-        summary, ["total_amount_1", "total_amount_2", "total_delta"]
-    )
+    wb = Workbook(write_only=True)
+    match_fill = PatternFill(fill_type="solid", fgColor="C6EFCE")
+    other_fill = PatternFill(fill_type="solid", fgColor="F4CCCC")
+    number_format = "#,##0.00"
+
+    def append_sheet(sheet_name: str, df: pd.DataFrame, money_cols: tuple[int, ...] = ()) -> None:
+        # Write-only sheets stream rows straight to disk, so every style and
+        # column width has to be known before the first row is appended.
+        ws = wb.create_sheet(sheet_name)
+        headers = [str(col) for col in df.columns]
+        # Resolve the per-row fill and per-column number format up front.
+        if "status" in df.columns:
+            row_fills = [match_fill if status == "MATCH" else other_fill for status in df["status"]]
+        else:
+            row_fills = [None] * len(df)
+        col_formats = [
+            number_format if col_idx in money_cols else None
+            for col_idx in range(1, len(headers) + 1)
+        ]
 
-    with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
-        detail_out.to_excel(writer, sheet_name="comparison", index=False)
-        summary_out.to_excel(writer, sheet_name="summary", index=False)
-
-        match_fill = PatternFill(fill_type="solid", fgColor="C6EFCE")
-        other_fill = PatternFill(fill_type="solid", fgColor="F4CCCC")
-
-        for sheet_name in ("comparison", "summary"):
-            ws = writer.book[sheet_name]
-            headers = [cell.value for cell in ws[1]]
-            if "status" not in headers:
-                continue
-            status_col_idx = headers.index("status") + 1
-
-            for row_idx in range(2, ws.max_row + 1):
-                status_value = ws.cell(row=row_idx, column=status_col_idx).value
-                fill = match_fill if status_value == "MATCH" else other_fill
-                for col_idx in range(1, ws.max_column + 1):
-                    ws.cell(row=row_idx, column=col_idx).fill = fill
-
-        # Comparison columns D/E/F contain monetary values.
-        ws_cmp = writer.book["comparison"]
-        number_format = "#,##0.00"
-        for row_idx in range(2, ws_cmp.max_row + 1):
-            for col_idx in (4, 5, 6):
-                ws_cmp.cell(row=row_idx, column=col_idx).number_format = number_format
-
-        # Fit column widths to visible content for easier reading.
-        for sheet_name in ("comparison", "summary"):
-            ws = writer.book[sheet_name]
-            for col_cells in ws.columns:
-                max_len = 0
-                col_letter = col_cells[0].column_letter
-                for cell in col_cells:
-                    value = "" if cell.value is None else str(cell.value)
-                    if len(value) > max_len:
-                        max_len = len(value)
-                ws.column_dimensions[col_letter].width = min(max_len + 2, 80)
+        # Fit column widths to visible content for easier reading. Widths are
+        # computed from the frame first, so rows can be streamed afterwards.
+        for col_idx, (header, col) in enumerate(zip(headers, df.columns), start=1):
+            values = df[col].dropna()
+            max_len = int(values.astype(str).str.len().max()) if len(values) else 0
+            width = max(len(header), max_len)
+            ws.column_dimensions[get_column_letter(col_idx)].width = min(width + 2, 80)
+
+        ws.append(headers)
+
+        for row, fill in zip(df.itertuples(index=False, name=None), row_fills):
+            row_cells = []
+            for value, col_format in zip(row, col_formats):
+                cell = WriteOnlyCell(ws, value=None if pd.isna(value) else value)
+                if fill is not None:
+                    cell.fill = fill
+                if col_format is not None:
+                    cell.number_format = col_format
+                row_cells.append(cell)
+            ws.append(row_cells)
 
         # Keep headers on row 1 and enable Excel filters for convenient viewing.
-        for sheet_name in ("comparison", "summary"):
-            ws = writer.book[sheet_name]
-            ws.auto_filter.ref = ws.dimensions
+        ws.auto_filter.ref = f"A1:{get_column_letter(len(headers))}{len(df) + 1}"
+
+    # Comparison columns D/E/F contain monetary values.
+    append_sheet("comparison", detail, money_cols=(4, 5, 6))
+    append_sheet("summary", summary)
+    wb.save(out_path)
 
 
 def open_report(path: Path) -> None: